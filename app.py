@@ -13,8 +13,13 @@ Dependencies:
 - Streamlit: pip install streamlit
 - OpenAI: pip install openai
 - Requests: pip install requests
+- Brotli: pip install Brotli (optional, for br-compressed responses)
+- charset-normalizer: pip install charset-normalizer
 - BeautifulSoup: pip install beautifulsoup4
+- lxml: pip install lxml
+- selectolax: pip install selectolax (optional, for faster HTML parsing)
 - Python-dotenv: pip install python-dotenv
+- tiktoken: pip install tiktoken (optional, for exact token counts)
 
 Usage:
 1. Obtain API keys for OpenAI and Azure, and store them in a .env file:
@@ -32,135 +37,21 @@ Features:
 
 """
 
-import os
-import requests
 import streamlit as st
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-import openai
-import re
-import io
-
-load_dotenv()
-
-def truncate_text(text, max_tokens):
-    """
-    Truncates the input text to stay within the maximum token limit.
-
-    Args:
-        text (str): The input text to truncate.
-        max_tokens (int): The maximum number of tokens allowed.
-
-    Returns:
-        str: The truncated text.
-    """
-    tokens = re.findall(r'\w+|\W+', text)
-    truncated_tokens = tokens[:max_tokens]
-    return ''.join(truncated_tokens)
-
-def get_openai_text(prompt, limit_tokens):
-    """
-    Sends a prompt to the OpenAI API and retrieves a generated response.
-
-    Args:
-        prompt (str): The text prompt for OpenAI to process.
-        limit_tokens (int): The maximum number of tokens in the response.
-
-    Returns:
-        str: The generated text from OpenAI, or None if an error occurs.
-    """
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=limit_tokens,
-            temperature=0.5
-        )
-        return response['choices'][0]['message']['content']
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error accessing OpenAI API: {e}")
-        return None
-
-def get_azure_access_token():
-    """
-    Retrieves an access token from Azure's Text-to-Speech API.
-
-    Returns:
-        str: The access token if successful, or None if an error occurs.
-    """
-    azure_key = os.getenv("AZURE_API_KEY")
-    try:
-        response = requests.post(
-            "https://eastus.api.cognitive.microsoft.com/sts/v1.0/issuetoken",
-            headers={
-                "Ocp-Apim-Subscription-Key": azure_key
-            }
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error accessing Azure API: {e}")
-        return None
-
-    return response.text
-
-def text_to_speech(text, voice_name='en-US-AriaNeural'):
-    """
-    Converts text to speech using Azure's Text-to-Speech API.
-
-    Args:
-        text (str): The text to convert to speech.
-        voice_name (str): The name of the voice for the speech output.
-
-    Returns:
-        bytes: The audio content in binary format, or None if an error occurs.
-    """
-    access_token = get_azure_access_token()
-    if not access_token:
-        return None
-
-    try:
-        response = requests.post(
-            "https://eastus.tts.speech.microsoft.com/cognitiveservices/v1",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/ssml+xml",
-                "X-MICROSOFT-OutputFormat": "riff-24khz-16bit-mono-pcm",
-                "User-Agent": "TextToSpeechApp",
-            },
-            data=f"""
-                <speak version='1.0' xml:lang='en-US'>
-                <voice name='{voice_name}'>
-                    {text}
-                </voice>
-                </speak>
-            """,
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error generating speech: {e}")
-        return None
-
-    return response.content
-
-def extract_content(url):
-    """
-    Extracts and concatenates paragraph text content from a specified URL.
-
-    Args:
-        url (str): The URL of the webpage to extract content from.
-
-    Returns:
-        str: The concatenated text content of all paragraphs, or None if an error occurs.
-    """
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        return ' '.join([p.text for p in soup.find_all('p')])
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error retrieving content from URL: {e}")
-        return None
+from tts_core import (
+    AZURE_VOICES,
+    BATCH_SYNTHESIS_MIN_CHARS,
+    decode_text_file,
+    extract_content,
+    get_openai_text,
+    prefetch_azure_token,
+    text_to_speech,
+    text_to_speech_batch,
+    text_to_speech_multi,
+    truncate_text,
+)
+
+INPUT_OPTIONS = ("URL", "Text Input", "File Upload")
 
 def main():
     """
@@ -171,7 +62,7 @@ def main():
     st.subheader("Generate Text with OpenAI and Convert it to Speech with Azure")
     st.info("Use OpenAI's API to generate text and Azure's API for text-to-speech. Choose to upload text, enter a URL, or paste text directly.")
 
-    input_option = st.selectbox("Choose input option:", ["URL", "Text Input", "File Upload"])
+    input_option = st.selectbox("Choose input option:", INPUT_OPTIONS)
     prompt_text = None
 
     if input_option == "URL":
@@ -183,22 +74,39 @@ def main():
     elif input_option == "File Upload":
         uploaded_file = st.file_uploader("Upload a text file (.txt)", type="txt")
         if uploaded_file:
-            prompt_text = uploaded_file.read().decode("utf-8")
+            prompt_text = decode_text_file(uploaded_file.getvalue())
 
-    limit_tokens = st.slider("Limit tokens for OpenAI response:", 100, 5000, step=100)
+    # The response and the prompt share the 4096-token budget, so leave room for a prompt.
+    limit_tokens = st.slider("Limit tokens for OpenAI response:", 100, 4000, step=100)
 
     if prompt_text:
         truncated_prompt_text = truncate_text(prompt_text, 4096 - limit_tokens)
 
+        st.write("Generated Text:")
+        # The Azure token does not depend on the generated text, so fetch it
+        # into the cache while the response streams in.
+        prefetch_azure_token()
         openai_text = get_openai_text(truncated_prompt_text, limit_tokens)
         if openai_text:
-            st.write("Generated Text:", openai_text)
-            voice_name = st.selectbox("Choose voice for TTS:", ['en-US-AriaNeural', 'en-US-GuyNeural', 'en-GB-RyanNeural'])
-            speech = text_to_speech(openai_text, voice_name)
+            voice_name = st.selectbox("Choose voice for TTS:", AZURE_VOICES)
+            use_batch = len(openai_text) > BATCH_SYNTHESIS_MIN_CHARS and st.checkbox(
+                "Use batch synthesis for long text",
+                help="Synthesizes the whole text in one Azure batch job. Jobs are queued, so audio takes longer to arrive."
+            )
+            if use_batch:
+                with st.spinner("Waiting for the batch synthesis job..."):
+                    speech = text_to_speech_batch(openai_text, voice_name)
+            else:
+                speech = text_to_speech(openai_text, voice_name)
             if speech:
                 st.audio(speech, format='audio/wav')
-                if st.button("Download audio file"):
-                    st.download_button(label="Download", data=speech, file_name="speech.wav", mime="audio/wav")
+                st.download_button(label="Download audio file", data=speech, file_name="speech.wav", mime="audio/wav")
+
+            with st.expander("Compare voices"):
+                compare_voices = st.multiselect("Voices to preview:", AZURE_VOICES)
+                for compare_voice, compare_speech in text_to_speech_multi(openai_text, compare_voices).items():
+                    st.write(compare_voice)
+                    st.audio(compare_speech, format='audio/wav')
 
 if __name__ == "__main__":
     main()
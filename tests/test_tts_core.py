@@ -0,0 +1,441 @@
+import inspect
+import io
+import os
+import socket
+import zipfile
+
+import pytest
+
+import tts_core
+
+
+def fake_getaddrinfo(*addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port or 0))
+            for address in addresses
+        ]
+    return getaddrinfo
+
+
+@pytest.mark.parametrize("address", [
+    "10.0.0.1",          # private
+    "192.168.1.1",       # private
+    "127.0.0.1",         # loopback
+    "::1",               # IPv6 loopback
+    "169.254.169.254",   # link-local (cloud metadata)
+    "fe80::1",           # IPv6 link-local
+    "100.64.0.1",        # carrier-grade NAT
+    "::ffff:127.0.0.1",  # IPv4-mapped loopback
+    "224.0.0.1",         # multicast
+])
+def test_is_public_url_rejects_non_public_addresses(monkeypatch, address):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo(address))
+    assert not tts_core.is_public_url("http://example.com/")
+
+
+def test_is_public_url_rejects_host_with_any_non_public_address(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo("93.184.215.14", "10.0.0.1"))
+    assert not tts_core.is_public_url("https://example.com/")
+
+
+def test_is_public_url_accepts_public_address(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo("93.184.215.14"))
+    assert tts_core.is_public_url("https://example.com/page")
+
+
+@pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/", "http:///path"])
+def test_is_public_url_rejects_other_schemes_and_missing_host(url):
+    assert not tts_core.is_public_url(url)
+
+
+def test_is_public_url_rejects_unresolvable_host(monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror("no such host")
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    assert not tts_core.is_public_url("https://example.invalid/")
+
+
+def test_open_public_url_connects_to_validated_address(monkeypatch):
+    # A rebinding resolver answers with a public address first and a private one after.
+    answers = iter(["93.184.215.14", "127.0.0.1"])
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: fake_getaddrinfo(next(answers))(*args, **kwargs))
+    requests_sent = []
+
+    class Response:
+        is_redirect = False
+
+    def get(session, url, headers=None, **kwargs):
+        requests_sent.append((url, headers))
+        return Response()
+
+    monkeypatch.setattr(tts_core.requests.Session, "get", get)
+    tts_core.open_public_url("https://example.com/article?id=1")
+    assert requests_sent == [("https://93.184.215.14:443/article?id=1", {"Host": "example.com"})]
+
+
+def test_open_public_url_falls_back_to_next_validated_address(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo("2606:2800:21f:cb07:6820:80da:af6b:8b2c", "93.184.215.14"))
+    urls = []
+
+    class Response:
+        is_redirect = False
+
+    def get(session, url, **kwargs):
+        urls.append(url)
+        if url.startswith("https://["):
+            raise tts_core.requests.exceptions.ConnectionError("Network is unreachable")
+        return Response()
+
+    monkeypatch.setattr(tts_core.requests.Session, "get", get)
+    tts_core.open_public_url("https://example.com/")
+    assert urls == ["https://[2606:2800:21f:cb07:6820:80da:af6b:8b2c]:443/", "https://93.184.215.14:443/"]
+
+
+def test_open_public_url_reuses_session_per_host(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo("93.184.215.14"))
+    sessions = []
+
+    class Response:
+        is_redirect = False
+
+    def get(session, url, **kwargs):
+        sessions.append(session)
+        return Response()
+
+    monkeypatch.setattr(tts_core.requests.Session, "get", get)
+    tts_core.open_public_url("https://example.com/a")
+    tts_core.open_public_url("https://example.com/b")
+    assert sessions[0] is sessions[1]
+
+
+def test_open_public_url_checks_redirect_targets(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", lambda host, *args, **kwargs: fake_getaddrinfo(
+        "10.0.0.1" if host == "internal.example" else "93.184.215.14")(host, *args, **kwargs))
+
+    class Response:
+        is_redirect = True
+        headers = {"Location": "http://internal.example/admin"}
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(tts_core.requests.Session, "get", lambda session, url, **kwargs: Response())
+    with pytest.raises(ValueError):
+        tts_core.open_public_url("https://example.com/")
+
+
+@pytest.mark.parametrize("max_tokens", [0, -904])
+def test_truncate_text_returns_empty_for_non_positive_budget(monkeypatch, max_tokens):
+    monkeypatch.setattr(tts_core, "tiktoken", None)
+    assert tts_core.truncate_text("Hello, world!", max_tokens) == ""
+
+
+class StubEncoding:
+    """Encodes each character as one token."""
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(map(chr, tokens))
+
+
+@pytest.mark.parametrize("max_tokens", [0, -904])
+def test_truncate_text_encoding_returns_empty_for_non_positive_budget(monkeypatch, max_tokens):
+    monkeypatch.setattr(tts_core, "tiktoken", object())
+    monkeypatch.setattr(tts_core, "get_token_encoding", lambda model: StubEncoding())
+    assert tts_core.truncate_text("Hello, world! " * 100, max_tokens) == ""
+
+
+def test_truncate_text_encoding_keeps_leading_tokens(monkeypatch):
+    monkeypatch.setattr(tts_core, "tiktoken", object())
+    monkeypatch.setattr(tts_core, "get_token_encoding", lambda model: StubEncoding())
+    assert tts_core.truncate_text("Hello, world!", 3) == "Hel"
+
+
+def test_truncate_text_regex_fallback_keeps_leading_tokens(monkeypatch):
+    monkeypatch.setattr(tts_core, "tiktoken", None)
+    assert tts_core.truncate_text("Hello, world! Bye.", 3) == "Hello, world"
+
+
+@pytest.mark.skipif(tts_core.tiktoken is None, reason="tiktoken is not installed")
+def test_get_token_encoding_remembers_load_failure(monkeypatch):
+    calls = []
+
+    def encoding_for_model(model):
+        calls.append(model)
+        raise OSError("network unreachable")
+
+    monkeypatch.setattr(tts_core.tiktoken, "encoding_for_model", encoding_for_model)
+    tts_core.get_token_encoding.clear()
+    try:
+        assert tts_core.get_token_encoding("test-model") is None
+        assert tts_core.get_token_encoding("test-model") is None
+    finally:
+        tts_core.get_token_encoding.clear()
+    assert calls == ["test-model"]
+
+
+SAMPLE_TEXT = " ".join(
+    f"Sentence number {i} talks about {'quite a few ' * (i % 7)}things! Is that right? Yes." for i in range(60)
+)
+
+
+def test_split_text_respects_chunk_size():
+    chunks = tts_core.split_text(SAMPLE_TEXT)
+    assert len(chunks) > 1
+    assert all(0 < len(chunk) <= tts_core.TTS_CHUNK_CHARS for chunk in chunks)
+
+
+def test_split_text_rejoins_without_losing_words():
+    chunks = tts_core.split_text(SAMPLE_TEXT + " " + "word " * 300)
+    assert " ".join(chunks).split() == (SAMPLE_TEXT + " " + "word " * 300).split()
+
+
+def test_split_text_breaks_at_sentence_boundaries():
+    sentence = "This sentence is exactly forty chars ok."
+    chunks = tts_core.split_text(" ".join([sentence] * 30), max_chars=100)
+    assert chunks == [f"{sentence} {sentence}"] * 15
+
+
+def test_split_text_cuts_spaceless_runs():
+    assert tts_core.split_text("a" * 1200) == ["a" * 500, "a" * 500, "a" * 200]
+
+
+@pytest.mark.parametrize("text", ["", "   \n"])
+def test_split_text_returns_no_chunks_for_empty_text(text):
+    assert tts_core.split_text(text) == []
+
+
+def cached_synthesizer(cache_dir, max_entries=tts_core.TTS_CACHE_MAX_ENTRIES):
+    calls = []
+
+    @tts_core.tts_cache(cache_dir=str(cache_dir), max_entries=max_entries)
+    def synthesize(text, voice_name, output_format):
+        calls.append(text)
+        return f"audio for {text}".encode()
+
+    return synthesize, calls
+
+
+def test_tts_cache_hit_skips_synthesis(tmp_path):
+    synthesize, calls = cached_synthesizer(tmp_path)
+    assert synthesize("Hello", "voice", "format") == b"audio for Hello"
+    assert synthesize("Hello", "voice", "format") == b"audio for Hello"
+    assert calls == ["Hello"]
+    # The voice and format are part of the key.
+    synthesize("Hello", "other voice", "format")
+    assert calls == ["Hello", "Hello"]
+
+
+def test_tts_cache_evicts_least_recently_used(tmp_path):
+    synthesize, calls = cached_synthesizer(tmp_path, max_entries=2)
+    synthesize("first", "voice", "format")
+    first_path, = tmp_path.iterdir()
+    synthesize("second", "voice", "format")
+    second_path, = set(tmp_path.iterdir()) - {first_path}
+    os.utime(first_path, (1, 1))
+    os.utime(second_path, (2, 2))
+
+    # A cache hit marks the first entry as recently used, so the second is evicted.
+    synthesize("first", "voice", "format")
+    synthesize("third", "voice", "format")
+    assert first_path.exists()
+    assert not second_path.exists()
+    assert len(list(tmp_path.iterdir())) == 2
+
+    synthesize("first", "voice", "format")
+    synthesize("second", "voice", "format")
+    assert calls == ["first", "second", "third", "second"]
+
+
+def test_tts_cache_returns_audio_when_cache_dir_is_unwritable(tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    synthesize, calls = cached_synthesizer(not_a_directory / "cache")
+    assert synthesize("Hello", "voice", "format") == b"audio for Hello"
+    assert synthesize("Hello", "voice", "format") == b"audio for Hello"
+    assert calls == ["Hello", "Hello"]
+    assert list(tmp_path.iterdir()) == [not_a_directory]
+
+
+def http_error(status_code):
+    response = tts_core.requests.Response()
+    response.status_code = status_code
+    return tts_core.requests.exceptions.HTTPError(f"{status_code} error", response=response)
+
+
+class StubTokenSource:
+    """Stands in for the cached get_azure_access_token."""
+
+    def __init__(self, *tokens):
+        self.tokens = iter(tokens)
+        self.clears = 0
+
+    def __call__(self):
+        return next(self.tokens)
+
+    def clear(self):
+        self.clears += 1
+
+
+def test_tts_core_refreshes_rejected_token_once(monkeypatch):
+    token_source = StubTokenSource("expired", "fresh")
+    used_tokens = []
+
+    def stream_speech(text, voice_name, output_format, access_token, session):
+        used_tokens.append(access_token)
+        if access_token == "expired":
+            raise http_error(401)
+        yield b"\0\0"
+
+    monkeypatch.setattr(tts_core, "get_azure_access_token", token_source)
+    monkeypatch.setattr(tts_core, "get_http_session", object)
+    monkeypatch.setattr(tts_core, "stream_speech", stream_speech)
+    audio = inspect.unwrap(tts_core._tts_core)("Hello.", "voice", tts_core.OUTPUT_FORMAT)
+
+    assert token_source.clears == 1
+    assert used_tokens == ["expired", "fresh"]
+    assert audio.startswith(b"RIFF")
+
+
+@pytest.mark.parametrize("status_code", [400, 500])
+def test_tts_core_reraises_other_http_errors(monkeypatch, status_code):
+    token_source = StubTokenSource("valid")
+
+    def stream_speech(text, voice_name, output_format, access_token, session):
+        raise http_error(status_code)
+        yield
+
+    monkeypatch.setattr(tts_core, "get_azure_access_token", token_source)
+    monkeypatch.setattr(tts_core, "get_http_session", object)
+    monkeypatch.setattr(tts_core, "stream_speech", stream_speech)
+    with pytest.raises(tts_core.requests.exceptions.HTTPError):
+        inspect.unwrap(tts_core._tts_core)("Hello.", "voice", tts_core.OUTPUT_FORMAT)
+    assert token_source.clears == 0
+
+
+def test_stream_speech_escapes_ssml_text():
+    sent = {}
+
+    class Response:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, chunk_size):
+            yield b"audio"
+
+    class Session:
+        def post(self, url, data=None, **kwargs):
+            sent["data"] = data
+            return Response()
+
+    text = "Tom & Jerry <3 >_< \"quotes\" and 'apostrophes'"
+    audio = b"".join(tts_core.stream_speech(text, "en-US-AriaNeural", tts_core.OUTPUT_FORMAT, "token", Session()))
+
+    assert audio == b"audio"
+    assert "Tom &amp; Jerry &lt;3 &gt;_&lt; &quot;quotes&quot; and &apos;apostrophes&apos;" in sent["data"]
+    assert text not in sent["data"]
+
+
+class StubBatchSession:
+    """Records the requests of one batch synthesis job and answers with canned responses."""
+
+    def __init__(self, status, archive_files=None, poll_error=None, delete_error=None):
+        self.status = status
+        self.archive_files = archive_files or {}
+        self.poll_error = poll_error
+        self.delete_error = delete_error
+        self.deleted = []
+
+    @staticmethod
+    def response(content=b"", json=None):
+        response = tts_core.requests.Response()
+        response.status_code = 200
+        response._content = content
+        response.json = lambda: json
+        return response
+
+    def put(self, url, **kwargs):
+        self.job_url = url
+        return self.response()
+
+    def get(self, url, **kwargs):
+        if url == self.job_url:
+            if self.poll_error:
+                raise self.poll_error
+            return self.response(json={"status": self.status, "outputs": {"result": "https://results/job.zip"}})
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, content in self.archive_files.items():
+                archive.writestr(name, content)
+        return self.response(content=buffer.getvalue())
+
+    def delete(self, url, **kwargs):
+        self.deleted.append(url)
+        if self.delete_error:
+            raise self.delete_error
+        return self.response()
+
+
+@pytest.fixture
+def batch_session(monkeypatch):
+    def use(session):
+        monkeypatch.setattr(tts_core, "get_http_session", lambda: session)
+        return session
+
+    monkeypatch.setattr(tts_core.time, "sleep", lambda seconds: None)
+    return use
+
+
+def run_batch_job():
+    return inspect.unwrap(tts_core._tts_batch_core)("Hello.", "voice", tts_core.BATCH_OUTPUT_FORMAT)
+
+
+def test_tts_batch_core_returns_audio_and_deletes_job(batch_session):
+    session = batch_session(StubBatchSession("Succeeded", {"0001.wav": b"RIFF audio", "summary.json": b"{}"}))
+    assert run_batch_job() == b"RIFF audio"
+    assert session.deleted == [session.job_url]
+
+
+def test_tts_batch_core_deletes_failed_job(batch_session):
+    session = batch_session(StubBatchSession("Failed"))
+    with pytest.raises(RuntimeError):
+        run_batch_job()
+    assert session.deleted == [session.job_url]
+
+
+def test_tts_batch_core_deletes_job_after_poll_error(batch_session):
+    session = batch_session(StubBatchSession("Running", poll_error=tts_core.requests.exceptions.ConnectionError()))
+    with pytest.raises(tts_core.requests.exceptions.ConnectionError):
+        run_batch_job()
+    assert session.deleted == [session.job_url]
+
+
+def test_tts_batch_core_deletes_job_that_times_out(batch_session, monkeypatch):
+    monkeypatch.setattr(tts_core, "BATCH_SYNTHESIS_TIMEOUT", -1)
+    session = batch_session(StubBatchSession("Running"))
+    with pytest.raises(TimeoutError):
+        run_batch_job()
+    assert session.deleted == [session.job_url]
+
+
+def test_tts_batch_core_rejects_archive_without_audio(batch_session):
+    session = batch_session(StubBatchSession("Succeeded", {"summary.json": b"{}"}))
+    with pytest.raises(RuntimeError, match="no audio"):
+        run_batch_job()
+    assert session.deleted == [session.job_url]
+
+
+def test_tts_batch_core_keeps_result_when_delete_fails(batch_session):
+    batch_session(StubBatchSession(
+        "Succeeded", {"0001.wav": b"RIFF audio"}, delete_error=tts_core.requests.exceptions.ConnectionError()
+    ))
+    assert run_batch_job() == b"RIFF audio"
@@ -0,0 +1,927 @@
+"""
+OpenAI & Azure Text-to-Speech Core
+----------------------------------
+
+Text generation, text-to-speech and content extraction functions used by the
+Streamlit interface in app.py. They live in an imported module so that Streamlit
+reruns, which re-execute app.py, do not redefine them, recompile their patterns
+or re-register their caches.
+
+Author: Fabio Carvalho
+License: Apache License 2.0
+"""
+
+import os
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from bs4 import BeautifulSoup, SoupStrainer
+from charset_normalizer import from_bytes
+from dotenv import load_dotenv
+import openai
+import re
+import io
+import hashlib
+import tempfile
+import functools
+import itertools
+import wave
+import time
+import threading
+import uuid
+import zipfile
+import socket
+import ipaddress
+from urllib.parse import urljoin, urlparse, urlunparse
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+@st.cache_resource
+def get_settings():
+    """
+    Loads the .env file once and returns the application settings, so Streamlit
+    reruns do not re-read the file or the environment.
+
+    Returns:
+        dict: The OpenAI and Azure API keys and the TTS cache directory.
+    """
+    load_dotenv()
+    return {
+        "openai_api_key": os.getenv("OPENAI_API_KEY"),
+        "azure_api_key": os.getenv("AZURE_API_KEY"),
+        "tts_cache_dir": os.getenv("TTS_CACHE_DIR", "./.tts_cache"),
+    }
+
+logger = logging.getLogger(__name__)
+
+AZURE_VOICES = ('en-US-AriaNeural', 'en-US-GuyNeural', 'en-GB-RyanNeural')
+OPENAI_MODEL = "gpt-4-turbo"
+OPENAI_TEMPERATURE = 0.5
+OPENAI_TIMEOUT = 60
+# Chunks are synthesized as headerless PCM so they can be concatenated;
+# TTS_SAMPLE_RATE must match OUTPUT_FORMAT.
+OUTPUT_FORMAT = "raw-24khz-16bit-mono-pcm"
+TTS_SAMPLE_RATE = 24000
+TTS_CHUNK_CHARS = 500
+TTS_MAX_WORKERS = 4
+TTS_STREAM_CHUNK_SIZE = 64 * 1024
+BATCH_OUTPUT_FORMAT = "riff-24khz-16bit-mono-pcm"
+BATCH_SYNTHESIS_API_VERSION = "2024-04-01"
+BATCH_SYNTHESIS_MIN_CHARS = 2000
+BATCH_SYNTHESIS_POLL_INTERVAL = 5
+BATCH_SYNTHESIS_TIMEOUT = 600
+TTS_CACHE_DIR = get_settings()["tts_cache_dir"]
+TTS_CACHE_MAX_ENTRIES = 256
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+# (connect, read) timeouts in seconds for every outgoing HTTP request.
+HTTP_TIMEOUT = (3, 30)
+MAX_REDIRECTS = 5
+
+_TOKEN_RE = re.compile(r'\w+|\W+')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+_PARAGRAPHS = SoupStrainer('p')
+_SSML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&apos;"})
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_prefetch_lock = threading.Lock()
+_prefetch_future = None
+
+def _evict_tts_cache(cache_dir, max_entries):
+    """
+    Deletes the least recently used entries from the TTS disk cache so that at
+    most max_entries remain.
+
+    Args:
+        cache_dir (str): The directory where cached audio files are stored.
+        max_entries (int): The maximum number of cached audio files to keep.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".wav"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+    if len(entries) <= max_entries:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _store_tts_cache(cache_dir, path, audio, max_entries):
+    """
+    Writes synthesized speech to the TTS disk cache and evicts old entries.
+    The cache is best-effort: failures are logged and the audio is not lost.
+
+    Args:
+        cache_dir (str): The directory where cached audio files are stored.
+        path (str): The path of the cache entry to write.
+        audio (bytes): The audio content to cache.
+        max_entries (int): The maximum number of cached audio files to keep.
+    """
+    temp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry.
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+            temp_path = f.name
+            f.write(audio)
+        os.replace(temp_path, path)
+        temp_path = None
+        _evict_tts_cache(cache_dir, max_entries)
+    except OSError as e:
+        logger.warning("Could not write TTS cache entry %s: %s", path, e)
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+def tts_cache(cache_dir=TTS_CACHE_DIR, max_entries=TTS_CACHE_MAX_ENTRIES):
+    """
+    Decorator that caches synthesized speech on disk, keyed by a hash of the
+    voice name, output format and text, so identical requests skip the Azure call.
+    Once the cache holds more than max_entries files, the least recently used are deleted.
+    Cache read and write errors are logged and never fail the synthesis.
+
+    Args:
+        cache_dir (str): The directory where cached audio files are stored.
+        max_entries (int): The maximum number of cached audio files to keep.
+
+    Returns:
+        callable: A decorator for functions with the signature (text, voice_name, output_format).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(text, voice_name=AZURE_VOICES[0], output_format=OUTPUT_FORMAT):
+            key = hashlib.sha256(f"{voice_name}|{output_format}|".encode() + text.encode("utf-8")).hexdigest()
+            path = os.path.join(cache_dir, f"{key}.wav")
+            try:
+                with open(path, "rb") as f:
+                    audio = f.read()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not read TTS cache entry %s: %s", path, e)
+            else:
+                logger.debug("TTS disk cache hit for %s", key)
+                try:
+                    # Mark the entry as recently used for eviction.
+                    os.utime(path)
+                except OSError:
+                    pass
+                return audio
+
+            audio = func(text, voice_name, output_format)
+            if audio:
+                _store_tts_cache(cache_dir, path, audio, max_entries)
+            return audio
+        return wrapper
+    return decorator
+
+@st.cache_resource(show_spinner=False)
+def get_token_encoding(model):
+    """
+    Loads the tiktoken encoding for a model once and reuses it across reruns.
+    The encoding file is downloaded on first use; if that fails, None is cached
+    as well, so later calls do not retry a download that may block for a long time.
+
+    Args:
+        model (str): The OpenAI model whose encoding is needed.
+
+    Returns:
+        tiktoken.Encoding: The model's encoding, cl100k_base if the model is unknown,
+        or None if the encoding cannot be loaded.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+        logger.warning("Could not load the tiktoken encoding for %s: %s", model, e)
+        return None
+
+def truncate_text(text, max_tokens, model=OPENAI_MODEL):
+    """
+    Truncates the input text to stay within the maximum token limit.
+    Tokens are counted exactly with the model's tiktoken encoding; if tiktoken
+    is not installed or its encoding cannot be loaded, runs of word and non-word
+    characters approximate them.
+
+    Args:
+        text (str): The input text to truncate.
+        max_tokens (int): The maximum number of tokens allowed.
+        model (str): The OpenAI model the text is sent to.
+
+    Returns:
+        str: The truncated text; empty if max_tokens is zero or negative.
+    """
+    max_tokens = max(max_tokens, 0)
+    encoding = get_token_encoding(model) if tiktoken is not None else None
+    if encoding is None:
+        # Every token spans at least one character, so short texts need no scan.
+        if len(text) <= max_tokens:
+            return text
+        # Stop scanning at the budget and slice the original string instead of
+        # materializing and rejoining every token.
+        end = 0
+        for match in itertools.islice(_TOKEN_RE.finditer(text), max_tokens):
+            end = match.end()
+        return text[:end]
+
+    # Every token spans at least one UTF-8 byte and a character at most four,
+    # so texts this short cannot exceed the limit and need no encoding.
+    if 4 * len(text) <= max_tokens:
+        return text
+
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens])
+
+def _http_adapter(adapter_class=HTTPAdapter, **kwargs):
+    """
+    Creates an HTTP adapter with the app's connection pool and retry settings.
+
+    Args:
+        adapter_class (type): The HTTPAdapter class to instantiate.
+        **kwargs: Extra arguments for the adapter class.
+
+    Returns:
+        requests.adapters.HTTPAdapter: The configured adapter.
+    """
+    return adapter_class(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # Token and synthesis POSTs have no side effects, so they are safe to retry.
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"}
+        ),
+        **kwargs
+    )
+
+class PinnedHostAdapter(HTTPAdapter):
+    """
+    HTTP adapter for requests sent to an IP address that has already been validated.
+    TLS still uses the original host name for SNI and certificate verification.
+
+    Args:
+        hostname (str): The host name the IP address was resolved from.
+    """
+
+    def __init__(self, hostname, **kwargs):
+        self.hostname = hostname
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self.hostname
+        kwargs["assert_hostname"] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+@st.cache_resource
+def get_http_session():
+    """
+    Creates one pooled HTTP session for Azure and URL requests so connections stay
+    warm across calls and Streamlit reruns. Transient failures (rate limits, 5xx
+    responses and connection errors) are retried with backoff, including for POST
+    requests.
+
+    Returns:
+        requests.Session: The shared HTTP session.
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = "TextToSpeechApp"
+    # The default Accept-Encoding already asks for gzip and deflate, and
+    # urllib3 adds br when the Brotli package is installed to decode it.
+    adapter = _http_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_openai_client():
+    """
+    Creates the OpenAI client once so it is reused across Streamlit reruns.
+    Requests time out after OPENAI_TIMEOUT seconds and transient errors are retried.
+
+    Returns:
+        openai.OpenAI: The shared OpenAI client.
+    """
+    return openai.OpenAI(
+        api_key=get_settings()["openai_api_key"],
+        timeout=OPENAI_TIMEOUT,
+        max_retries=3
+    )
+
+def stream_openai_text(prompt, model, max_tokens, temperature):
+    """
+    Sends a prompt to the OpenAI API and yields the response as it is generated.
+
+    Args:
+        prompt (str): The text prompt for OpenAI to process.
+        model (str): The OpenAI model to use.
+        max_tokens (int): The maximum number of tokens in the response.
+        temperature (float): The sampling temperature.
+
+    Yields:
+        str: Successive fragments of the generated text.
+
+    Raises:
+        openai.OpenAIError: If the API call fails.
+    """
+    stream = get_openai_client().chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+def get_openai_text(prompt, limit_tokens):
+    """
+    Sends a prompt to the OpenAI API and writes the response to the page as it streams in.
+    The last response is kept in the session state, so reruns with the same prompt
+    redisplay it instead of calling the API again.
+
+    Args:
+        prompt (str): The text prompt for OpenAI to process.
+        limit_tokens (int): The maximum number of tokens in the response.
+
+    Returns:
+        str: The generated text from OpenAI, or None if an error occurs.
+    """
+    request = (prompt, OPENAI_MODEL, limit_tokens, OPENAI_TEMPERATURE)
+    cached = st.session_state.get("openai_response")
+    if cached and cached[0] == request:
+        st.write(cached[1])
+        return cached[1]
+
+    try:
+        openai_text = st.write_stream(stream_openai_text(*request))
+    except openai.APITimeoutError as e:
+        logger.error("OpenAI API timeout: %s", e)
+        st.error("OpenAI did not respond in time. Please try again.")
+        return None
+    except openai.OpenAIError as e:
+        logger.error("OpenAI API error: %s", e)
+        st.error(f"Error accessing OpenAI API: {e}")
+        return None
+
+    st.session_state["openai_response"] = (request, openai_text)
+    return openai_text
+
+def _in_script_context(func):
+    """
+    Wraps a function so that it runs with the calling script's run context when it
+    is called from another thread. Streamlit's caches look the context up and log a
+    warning on every call from a thread without one.
+
+    Args:
+        func (callable): The function to run in a worker thread.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args, **kwargs)
+    return run
+
+@st.cache_resource(ttl=540, show_spinner=False)
+def get_azure_access_token():
+    """
+    Retrieves an access token from Azure's Text-to-Speech API.
+    Tokens are valid for 10 minutes, so each one is reused for 9 minutes
+    instead of being requested before every synthesis.
+
+    Returns:
+        str: The access token.
+
+    Raises:
+        requests.exceptions.RequestException: If the token request fails.
+    """
+    azure_key = get_settings()["azure_api_key"]
+    response = get_http_session().post(
+        "https://eastus.api.cognitive.microsoft.com/sts/v1.0/issuetoken",
+        headers={
+            "Ocp-Apim-Subscription-Key": azure_key
+        },
+        timeout=HTTP_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.text
+
+def prefetch_azure_token():
+    """
+    Starts fetching the Azure access token into the cache in the background and
+    returns immediately. Nothing new is queued while an earlier prefetch is still
+    running, so a slow or failing Azure does not build up a backlog across reruns.
+    Errors are ignored here; synthesis requests the token again and reports them.
+    """
+    global _prefetch_future
+    with _prefetch_lock:
+        if _prefetch_future is None or _prefetch_future.done():
+            _prefetch_future = _PREFETCH_EXECUTOR.submit(_in_script_context(get_azure_access_token))
+
+def split_text(text, max_chars=TTS_CHUNK_CHARS):
+    """
+    Splits text into chunks of at most max_chars characters, breaking at sentence
+    boundaries where possible and at spaces for sentences longer than max_chars.
+
+    Args:
+        text (str): The text to split.
+        max_chars (int): The maximum number of characters per chunk.
+
+    Returns:
+        list: The text chunks, in order.
+    """
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END_RE.split(text.strip()):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            chunks.append(current)
+            current = sentence
+        elif sentence:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+def stream_speech(text, voice_name, output_format, access_token, session):
+    """
+    Requests speech from Azure's Text-to-Speech API and yields the audio as it arrives,
+    instead of waiting for the whole response body to be buffered. The text is
+    XML-escaped before it is embedded in the SSML document.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_name (str): The name of the voice for the speech output.
+        output_format (str): The Azure audio output format.
+        access_token (str): The Azure access token.
+        session (requests.Session): The HTTP session to send the request with.
+
+    Yields:
+        bytes: Successive chunks of the audio content, up to TTS_STREAM_CHUNK_SIZE bytes each.
+
+    Raises:
+        requests.exceptions.RequestException: If the speech request fails.
+    """
+    with session.post(
+        "https://eastus.tts.speech.microsoft.com/cognitiveservices/v1",
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/ssml+xml",
+            "X-MICROSOFT-OutputFormat": output_format,
+        },
+        data=f"""
+            <speak version='1.0' xml:lang='en-US'>
+            <voice name='{voice_name}'>
+                {text.translate(_SSML_ESCAPE)}
+            </voice>
+            </speak>
+        """,
+        stream=True,
+        timeout=HTTP_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+@tts_cache()
+def _tts_core(text, voice_name, output_format):
+    """
+    Converts text to speech using Azure's Text-to-Speech API. The text is split at
+    sentence boundaries and the chunks are synthesized concurrently as raw PCM, then
+    joined into a single WAV file. Results are memoized in process and cached on disk,
+    so repeated requests skip the API call.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_name (str): The name of the voice for the speech output.
+        output_format (str): The raw PCM Azure output format, matching TTS_SAMPLE_RATE.
+
+    Returns:
+        bytes: The audio content in WAV format.
+
+    Raises:
+        requests.exceptions.RequestException: If the token or speech request fails.
+    """
+    chunks = split_text(text)
+    # Cached resources are fetched here rather than in the worker threads, which
+    # have no script run context and would log a warning for every lookup.
+    session = get_http_session()
+
+    def synthesize_all(access_token):
+        def synthesize(chunk):
+            return b"".join(stream_speech(chunk, voice_name, output_format, access_token, session))
+
+        with ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as executor:
+            return list(executor.map(synthesize, chunks))
+
+    try:
+        pcm_chunks = synthesize_all(get_azure_access_token())
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 401:
+            raise
+        # The cached token was rejected before its TTL ran out; fetch a fresh one once.
+        get_azure_access_token.clear()
+        pcm_chunks = synthesize_all(get_azure_access_token())
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(TTS_SAMPLE_RATE)
+        for pcm in pcm_chunks:
+            wav.writeframes(pcm)
+    return buffer.getvalue()
+
+def _report_speech_error(error, voice_name=None):
+    """
+    Logs a speech synthesis error and shows it on the page, with a dedicated
+    message when Azure did not respond in time.
+
+    Args:
+        error (Exception): The error raised while synthesizing speech.
+        voice_name (str): The voice being synthesized, if several are.
+    """
+    voice = f" with {voice_name}" if voice_name else ""
+    if isinstance(error, requests.exceptions.Timeout):
+        logger.error("Azure speech synthesis timeout%s: %s", voice, error)
+        st.error(f"Azure did not respond in time{voice}. Please try again.")
+    else:
+        logger.error("Azure speech synthesis error%s: %s", voice, error)
+        st.error(f"Error generating speech{voice}: {error}")
+
+def text_to_speech(text, voice_name=AZURE_VOICES[0]):
+    """
+    Converts text to speech using Azure's Text-to-Speech API.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_name (str): The name of the voice for the speech output.
+
+    Returns:
+        bytes: The audio content in binary format, or None if an error occurs.
+    """
+    try:
+        return _tts_core(text, voice_name, OUTPUT_FORMAT)
+    except (requests.exceptions.RequestException, OSError) as e:
+        _report_speech_error(e)
+        return None
+
+def text_to_speech_multi(text, voice_names):
+    """
+    Converts text to speech in several voices, synthesizing the voices concurrently.
+    Each voice is cached separately, so only voices not synthesized before call Azure.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_names (list): The names of the voices to synthesize.
+
+    Returns:
+        dict: The audio content in binary format for each voice that was synthesized successfully.
+    """
+    if not voice_names:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(voice_names)) as executor:
+        synthesize = _in_script_context(_tts_core)
+        futures = {voice_name: executor.submit(synthesize, text, voice_name, OUTPUT_FORMAT) for voice_name in voice_names}
+
+    speeches = {}
+    # Errors are reported here rather than in the worker threads, which cannot write to the page.
+    for voice_name, future in futures.items():
+        try:
+            speeches[voice_name] = future.result()
+        except (requests.exceptions.RequestException, OSError) as e:
+            _report_speech_error(e, voice_name)
+    return speeches
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+@tts_cache()
+def _tts_batch_core(text, voice_name, output_format):
+    """
+    Converts text to speech using Azure's Batch Synthesis API: submits a job,
+    polls it until it finishes and extracts the audio from the result archive.
+    Results are memoized in process and cached on disk, like _tts_core.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_name (str): The name of the voice for the speech output.
+        output_format (str): The Azure audio output format.
+
+    Returns:
+        bytes: The audio content in binary format.
+
+    Raises:
+        requests.exceptions.RequestException: If a batch synthesis request fails.
+        RuntimeError: If the batch synthesis job fails or its result has no audio.
+        TimeoutError: If the job does not finish within BATCH_SYNTHESIS_TIMEOUT seconds.
+        zipfile.BadZipFile: If the result archive is corrupt.
+        KeyError: If the job status response is missing the expected fields.
+    """
+    session = get_http_session()
+    job_url = f"https://eastus.api.cognitive.microsoft.com/texttospeech/batchsyntheses/{uuid.uuid4()}"
+    params = {"api-version": BATCH_SYNTHESIS_API_VERSION}
+    headers = {"Ocp-Apim-Subscription-Key": get_settings()["azure_api_key"]}
+
+    response = session.put(
+        job_url,
+        params=params,
+        headers=headers,
+        json={
+            "inputKind": "PlainText",
+            "inputs": [{"content": text}],
+            "synthesisConfig": {"voice": voice_name},
+            "properties": {"outputFormat": output_format},
+        },
+        timeout=HTTP_TIMEOUT
+    )
+    response.raise_for_status()
+
+    try:
+        deadline = time.monotonic() + BATCH_SYNTHESIS_TIMEOUT
+        while True:
+            time.sleep(BATCH_SYNTHESIS_POLL_INTERVAL)
+            response = session.get(job_url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            job = response.json()
+            if job["status"] == "Succeeded":
+                break
+            if job["status"] == "Failed":
+                raise RuntimeError(f"Batch synthesis job failed: {job.get('properties', {}).get('error')}")
+            if time.monotonic() > deadline:
+                raise TimeoutError("Batch synthesis job did not finish in time")
+
+        response = session.get(job["outputs"]["result"], timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+    finally:
+        # Delete the job whether or not it succeeded; a failed delete must not hide the result.
+        try:
+            session.delete(job_url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not delete batch synthesis job %s: %s", job_url, e)
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        audio_name = next((name for name in archive.namelist() if name.endswith(".wav")), None)
+        if audio_name is None:
+            raise RuntimeError("Batch synthesis result contains no audio file")
+        return archive.read(audio_name)
+
+def text_to_speech_batch(text, voice_name=AZURE_VOICES[0]):
+    """
+    Converts long text to speech using Azure's Batch Synthesis API. Jobs are queued,
+    so this is slower to start than text_to_speech but handles long documents in one job.
+
+    Args:
+        text (str): The text to convert to speech.
+        voice_name (str): The name of the voice for the speech output.
+
+    Returns:
+        bytes: The audio content in binary format, or None if an error occurs.
+    """
+    try:
+        return _tts_batch_core(text, voice_name, BATCH_OUTPUT_FORMAT)
+    except (requests.exceptions.RequestException, OSError, RuntimeError,
+            zipfile.BadZipFile, KeyError) as e:
+        _report_speech_error(e)
+        return None
+
+def resolve_public_addresses(url):
+    """
+    Checks that a URL uses HTTP(S) and that its host resolves only to public
+    addresses, so URL input cannot be used to reach private or internal services.
+
+    Args:
+        url (str): The URL to check.
+
+    Returns:
+        list: The host's addresses to connect to, in resolver order, or an empty
+        list if the URL is not safe to fetch.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return []
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return []
+    # getaddrinfo repeats each address once per socket type.
+    ips = list(dict.fromkeys(ipaddress.ip_address(sockaddr[0].split('%')[0]) for *_, sockaddr in addresses))
+    if any(not ip.is_global or ip.is_multicast for ip in ips):
+        return []
+    return ips
+
+def is_public_url(url):
+    """
+    Checks that a URL uses HTTP(S) and that its host resolves only to public addresses.
+
+    Args:
+        url (str): The URL to check.
+
+    Returns:
+        bool: True if the URL is safe to fetch, False otherwise.
+    """
+    return bool(resolve_public_addresses(url))
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _get_pinned_session(hostname):
+    """
+    Creates a pooled HTTP session for fetches from one host that connect to its
+    already validated addresses, so repeat fetches from the host reuse connections.
+
+    Args:
+        hostname (str): The host name the addresses were resolved from.
+
+    Returns:
+        requests.Session: The session for the host.
+    """
+    session = requests.Session()
+    session.headers.update(get_http_session().headers)
+    session.mount("https://", _http_adapter(PinnedHostAdapter, hostname=hostname))
+    session.mount("http://", _http_adapter())
+    return session
+
+def _get_pinned(url, addresses):
+    """
+    Sends a streaming GET request for a URL to one of its host's already validated
+    addresses, so the host name is not resolved again when connecting (which DNS
+    rebinding could exploit). The addresses are tried in order until one connects.
+
+    Args:
+        url (str): The URL to fetch.
+        addresses (list): The validated addresses of its host.
+
+    Returns:
+        requests.Response: The open streaming response; the caller must close it.
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails, or no address accepts a connection.
+    """
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    session = _get_pinned_session(parsed.hostname)
+    for address in addresses:
+        host = f"[{address}]" if address.version == 6 else str(address)
+        try:
+            return session.get(
+                urlunparse(parsed._replace(netloc=f"{host}:{port}")),
+                headers={"Host": parsed.netloc.rpartition("@")[2]},
+                stream=True,
+                allow_redirects=False,
+                timeout=HTTP_TIMEOUT
+            )
+        except requests.exceptions.ConnectionError as e:
+            # A host may publish addresses this machine cannot reach, such as IPv6 ones.
+            logger.info("Could not connect to %s at %s: %s", parsed.hostname, address, e)
+            error = e
+    raise error
+
+def open_public_url(url):
+    """
+    Opens a streaming GET request to a public URL. The host and every redirect target
+    are resolved once, checked with resolve_public_addresses, and connected to at
+    exactly the checked addresses.
+
+    Args:
+        url (str): The URL to fetch.
+
+    Returns:
+        requests.Response: The open streaming response; the caller must close it.
+
+    Raises:
+        ValueError: If the URL or a redirect target is not a public HTTP(S) address.
+        requests.exceptions.RequestException: If the request fails or redirects too often.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        addresses = resolve_public_addresses(url)
+        if not addresses:
+            raise ValueError(f"URL must point to a public http(s) address: {url}")
+        response = _get_pinned(url, addresses)
+        if not response.is_redirect:
+            return response
+        url = urljoin(url, response.headers["Location"])
+        response.close()
+    raise requests.exceptions.TooManyRedirects(f"Exceeded {MAX_REDIRECTS} redirects")
+
+def extract_paragraphs(html):
+    """
+    Extracts and concatenates the text of the <p> elements in an HTML document.
+    selectolax's C parser is used when installed; otherwise BeautifulSoup with lxml
+    builds only the <p> elements.
+
+    Args:
+        html (bytes): The HTML document.
+
+    Returns:
+        str: The concatenated text content of all non-empty paragraphs.
+    """
+    if HTMLParser is not None:
+        paragraphs = (node.text() for node in HTMLParser(html).css('p'))
+    else:
+        soup = BeautifulSoup(html, "lxml", parse_only=_PARAGRAPHS)
+        paragraphs = (p.get_text() for p in soup.find_all('p'))
+    return ' '.join(text for paragraph in paragraphs if (text := paragraph.strip()))
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def _fetch_content(url):
+    """
+    Downloads a webpage and extracts its paragraph text. At most MAX_PAGE_BYTES
+    of the page are downloaded, since the prompt is truncated to a few thousand
+    tokens anyway. Results are memoized, so reruns do not fetch the page again.
+
+    Args:
+        url (str): The URL of the webpage to extract content from.
+
+    Returns:
+        str: The concatenated text content of all paragraphs.
+
+    Raises:
+        ValueError: If the URL or a redirect target is not a public HTTP(S) address.
+        requests.exceptions.RequestException: If the request fails.
+    """
+    with open_public_url(url) as response:
+        response.raise_for_status()
+        html = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            html += chunk
+            if len(html) >= MAX_PAGE_BYTES:
+                break
+    return extract_paragraphs(bytes(html))
+
+def extract_content(url):
+    """
+    Extracts and concatenates paragraph text content from a specified URL.
+
+    Args:
+        url (str): The URL of the webpage to extract content from.
+
+    Returns:
+        str: The concatenated text content of all paragraphs, or None if an error occurs.
+    """
+    try:
+        return _fetch_content(url)
+    except requests.exceptions.Timeout as e:
+        logger.error("Timeout retrieving %s: %s", url, e)
+        st.error("The URL did not respond in time. Please try again.")
+        return None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("Error retrieving %s: %s", url, e)
+        st.error(f"Error retrieving content from URL: {e}")
+        return None
+
+def decode_text_file(content):
+    """
+    Decodes the contents of an uploaded text file. UTF-8 (with or without a BOM)
+    is tried first; any other encoding is detected with charset-normalizer in one pass.
+
+    Args:
+        content (bytes): The raw file contents.
+
+    Returns:
+        str: The decoded text, or None if the encoding cannot be detected.
+    """
+    try:
+        return content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        pass
+
+    match = from_bytes(content).best()
+    if match is None:
+        st.error("Could not detect the encoding of the uploaded file.")
+        return None
+    return str(match)